@@ -1,20 +1,48 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Query, status
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from pymongo import MongoClient
-from bson import ObjectId
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+from pymongo import MongoClient, ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout, OperationFailure
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from bson import ObjectId, encode as bson_encode
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient, BlobBlock, generate_blob_sas, BlobSasPermissions
+import asyncio
+import base64
+import bisect
+import gzip
+import hashlib
+import heapq
+import io
+import json
 import os
+import re
+import threading
+import time
+import unicodedata
 import uuid
+import zipfile
+import zlib
+from collections import OrderedDict
 from dotenv import load_dotenv
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 load_dotenv()
 
+# Used to report how long the process took to start accepting requests
+PROCESS_STARTED_AT = time.perf_counter()
+
 app = FastAPI(title="Skilling in a Box API", version="1.0.0")
 
 # CORS - Allow all origins for cross-domain requests
@@ -39,26 +67,139 @@ app.add_middleware(
 
 # MongoDB
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/skillingbox")
-client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+# MongoClient connects lazily in background threads, so this does not block import
+client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS)
 db = client.skillingbox
 
+# Analytics and exports read from secondaries (within a staleness bound) so
+# they do not compete with auth and writes, which stay on the primary
+ANALYTICS_READ_PREFERENCE = os.getenv("ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+ANALYTICS_MAX_STALENESS_SECONDS = int(os.getenv("ANALYTICS_MAX_STALENESS_SECONDS", 120))
+ANALYTICS_MAX_TIME_MS = int(os.getenv("ANALYTICS_MAX_TIME_MS", 10000))
+ANALYTICS_ALLOW_DISK_USE = os.getenv("ANALYTICS_ALLOW_DISK_USE", "false").lower() == "true"
+ANALYTICS_BATCH_SIZE = int(os.getenv("ANALYTICS_BATCH_SIZE", 1000))
+
+READ_PREFERENCES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+if ANALYTICS_READ_PREFERENCE == "primary":
+    analytics_read_preference = Primary()
+elif ANALYTICS_READ_PREFERENCE in READ_PREFERENCES:
+    # Mongo requires maxStalenessSeconds >= 90
+    analytics_read_preference = READ_PREFERENCES[ANALYTICS_READ_PREFERENCE](
+        max_staleness=max(ANALYTICS_MAX_STALENESS_SECONDS, 90)
+    )
+else:
+    raise ValueError(f"Invalid ANALYTICS_READ_PREFERENCE: {ANALYTICS_READ_PREFERENCE}")
+analytics_db = client.get_database(db.name, read_preference=analytics_read_preference)
+
 # Azure Blob Storage
 AZURE_STORAGE_ACCOUNT = os.getenv("AZURE_STORAGE_ACCOUNT")
 AZURE_STORAGE_KEY = os.getenv("AZURE_STORAGE_KEY")
 AZURE_CONTAINER_NAME = os.getenv("AZURE_CONTAINER_NAME", "skilling-content")
 
+# Course bundles: zip archives assembled on the fly from blob reads. Memory is
+# bounded by BUNDLE_PREFETCH_FILES * BUNDLE_PREFETCH_CHUNKS * BUNDLE_CHUNK_SIZE.
+BUNDLE_CHUNK_SIZE = int(os.getenv("BUNDLE_CHUNK_SIZE", 4 * 1024 * 1024))
+BUNDLE_PREFETCH_FILES = int(os.getenv("BUNDLE_PREFETCH_FILES", 2))
+BUNDLE_PREFETCH_CHUNKS = int(os.getenv("BUNDLE_PREFETCH_CHUNKS", 2))
+BUNDLE_CACHE_ENABLED = os.getenv("BUNDLE_CACHE_ENABLED", "false").lower() == "true"
+
 blob_service_client = None
 container_client = None
+# Separate client so bundle reads fetch blobs in BUNDLE_CHUNK_SIZE ranges
+# instead of the SDK's 32MB initial download
+streaming_container_client = None
 
+# Client construction does no network I/O; the container existence check runs
+# in the background after startup (see warm_up_dependencies)
 try:
     connection_string = f"DefaultEndpointsProtocol=https;AccountName={AZURE_STORAGE_ACCOUNT};AccountKey={AZURE_STORAGE_KEY};EndpointSuffix=core.windows.net"
     blob_service_client = BlobServiceClient.from_connection_string(connection_string)
     container_client = blob_service_client.get_container_client(AZURE_CONTAINER_NAME)
-    if not container_client.exists():
-        container_client.create_container()
+    streaming_container_client = BlobServiceClient.from_connection_string(
+        connection_string,
+        max_single_get_size=BUNDLE_CHUNK_SIZE,
+        max_chunk_get_size=BUNDLE_CHUNK_SIZE
+    ).get_container_client(AZURE_CONTAINER_NAME)
 except Exception as e:
     print(f"Azure Blob Storage connection error: {e}")
 
+# SAS URL cache: tokens get expiries aligned to SAS_EXPIRY_BUCKET_MINUTES so that
+# repeat requests within a window produce identical (cacheable) URLs, and are
+# reused until SAS_REUSE_MARGIN_MINUTES before they expire
+SAS_CACHE_MAX_ENTRIES = int(os.getenv("SAS_CACHE_MAX_ENTRIES", 10000))
+SAS_EXPIRY_BUCKET_MINUTES = int(os.getenv("SAS_EXPIRY_BUCKET_MINUTES", 15))
+SAS_REUSE_MARGIN_MINUTES = int(os.getenv("SAS_REUSE_MARGIN_MINUTES", 60))
+
+sas_url_cache = OrderedDict()
+sas_url_cache_lock = threading.Lock()
+
+# Background jobs: Mongo-backed queue (db.jobs) drained by in-process workers
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+JOB_LOCK_SECONDS = int(os.getenv("JOB_LOCK_SECONDS", 300))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", 30))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 7))
+ORPHAN_SWEEP_INTERVAL_MINUTES = int(os.getenv("ORPHAN_SWEEP_INTERVAL_MINUTES", 360))
+ORPHAN_GRACE_HOURS = int(os.getenv("ORPHAN_GRACE_HOURS", 24))
+
+# Download log retention: raw download_logs rows are rolled up into per-day,
+# per-course buckets (db.download_daily), exported as gzipped JSON lines to
+# blob storage, then expire DOWNLOAD_LOG_RAW_RETENTION_DAYS after their day
+DOWNLOAD_LOG_RAW_RETENTION_DAYS = int(os.getenv("DOWNLOAD_LOG_RAW_RETENTION_DAYS", 90))
+DOWNLOAD_LOG_ARCHIVE_ENABLED = os.getenv("DOWNLOAD_LOG_ARCHIVE_ENABLED", "true").lower() == "true"
+DOWNLOAD_ROLLUP_INTERVAL_MINUTES = int(os.getenv("DOWNLOAD_ROLLUP_INTERVAL_MINUTES", 60))
+DOWNLOAD_ROLLUP_DELAY_MINUTES = int(os.getenv("DOWNLOAD_ROLLUP_DELAY_MINUTES", 30))
+DOWNLOAD_ROLLUP_MAX_DAYS_PER_RUN = int(os.getenv("DOWNLOAD_ROLLUP_MAX_DAYS_PER_RUN", 31))
+
+# Catalog replica: in-process copy of db.courses kept current by a change
+# stream (or polling on a standalone server). Reads fall back to Mongo when
+# the replica has not synced within CATALOG_MAX_STALENESS_SECONDS.
+CATALOG_REPLICA_ENABLED = os.getenv("CATALOG_REPLICA_ENABLED", "true").lower() == "true"
+CATALOG_MAX_STALENESS_SECONDS = int(os.getenv("CATALOG_MAX_STALENESS_SECONDS", 30))
+CATALOG_POLL_SECONDS = int(os.getenv("CATALOG_POLL_SECONDS", 10))
+CATALOG_RETRY_SECONDS = int(os.getenv("CATALOG_RETRY_SECONDS", 5))
+CATALOG_POLL_OVERLAP_SECONDS = int(os.getenv("CATALOG_POLL_OVERLAP_SECONDS", 60))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", 100))
+
+# Analytics: results are fresh for ANALYTICS_CACHE_TTL_SECONDS, then served
+# stale (while one background refresh runs) for ANALYTICS_CACHE_STALE_SECONDS
+ANALYTICS_CACHE_TTL_SECONDS = int(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", 30))
+ANALYTICS_CACHE_STALE_SECONDS = int(os.getenv("ANALYTICS_CACHE_STALE_SECONDS", 300))
+ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", 256))
+
+# Response compression: gzip/brotli negotiated per request. Responses carrying
+# an ETag are compressed once at higher quality and cached by (ETag, encoding).
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+COMPRESSION_CACHE_MAX_BYTES = int(os.getenv("COMPRESSION_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+COMPRESSION_CACHED_BROTLI_QUALITY = int(os.getenv("COMPRESSION_CACHED_BROTLI_QUALITY", 8))
+COMPRESSION_CACHED_GZIP_LEVEL = int(os.getenv("COMPRESSION_CACHED_GZIP_LEVEL", 9))
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "application/xml", "image/svg+xml")
+
+# Typeahead: maximum index entries examined per suggestion lookup
+# Caps the matching entries examined per suggest lookup, not the number of suggestions returned
+SUGGEST_SCAN_LIMIT = int(os.getenv("SUGGEST_SCAN_LIMIT", 2000))
+
+background_tasks = []
+
+# Readiness: dependency status is refreshed when older than this many seconds
+READINESS_RECHECK_SECONDS = int(os.getenv("READINESS_RECHECK_SECONDS", 15))
+
+dependency_status = {
+    "mongodb": {"ok": False, "checked_at": None, "latency_ms": None, "error": None},
+    "storage": {"ok": False, "checked_at": None, "latency_ms": None, "error": None},
+}
+# At most one background refresh of dependency_status at a time
+readiness_refresh = {"task": None}
+
 # JWT Config
 JWT_SECRET = os.getenv("JWT_SECRET", "skillingbox_secret")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
@@ -236,24 +377,1394 @@ def require_role(allowed_roles: List[str]):
         return user
     return role_checker
 
-def generate_sas_url(blob_name: str, expiry_hours: int = 24) -> str:
+def bucketed_expiry(now: datetime, expiry_hours: int) -> datetime:
+    # Round the expiry up to the next bucket boundary
+    bucket_seconds = SAS_EXPIRY_BUCKET_MINUTES * 60
+    target = now + timedelta(hours=expiry_hours)
+    epoch_seconds = int((target - datetime(1970, 1, 1)).total_seconds())
+    aligned = -(-epoch_seconds // bucket_seconds) * bucket_seconds
+    return datetime(1970, 1, 1) + timedelta(seconds=aligned)
+
+def generate_sas_url(blob_name: str, expiry_hours: int = 24, permission: str = "r") -> str:
     if not blob_service_client:
         return None
+    
+    now = datetime.utcnow()
+    key = (blob_name, permission, expiry_hours)
+    with sas_url_cache_lock:
+        cached = sas_url_cache.get(key)
+        if cached and cached["expires_at"] - timedelta(minutes=SAS_REUSE_MARGIN_MINUTES) > now:
+            sas_url_cache.move_to_end(key)
+            return cached["url"]
+    
+    expires_at = bucketed_expiry(now, expiry_hours)
     sas_token = generate_blob_sas(
         account_name=AZURE_STORAGE_ACCOUNT,
         container_name=AZURE_CONTAINER_NAME,
         blob_name=blob_name,
         account_key=AZURE_STORAGE_KEY,
-        permission=BlobSasPermissions(read=True),
-        expiry=datetime.utcnow() + timedelta(hours=expiry_hours)
+        permission=BlobSasPermissions.from_string(permission),
+        expiry=expires_at
     )
-    return f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net/{AZURE_CONTAINER_NAME}/{blob_name}?{sas_token}"
+    url = f"https://{AZURE_STORAGE_ACCOUNT}.blob.core.windows.net/{AZURE_CONTAINER_NAME}/{blob_name}?{sas_token}"
+    
+    with sas_url_cache_lock:
+        sas_url_cache[key] = {"url": url, "expires_at": expires_at}
+        sas_url_cache.move_to_end(key)
+        while len(sas_url_cache) > SAS_CACHE_MAX_ENTRIES:
+            sas_url_cache.popitem(last=False)
+    return url
+
+def invalidate_sas_urls(blob_name: str):
+    with sas_url_cache_lock:
+        for key in [k for k in sas_url_cache if k[0] == blob_name]:
+            del sas_url_cache[key]
+
+# Course bundle helpers
+class ZipStreamBuffer:
+    """Write-only sink for zipfile that hands back bytes as they are produced."""
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+    
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self.position
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+class BlobPrefetcher:
+    """Reads a blob's chunks on a worker thread and hands them to the event loop.
+    
+    A semaphore bounds how many chunks are buffered; the consumer awaits an
+    asyncio.Queue, so a cancelled bundle never leaves a thread blocked.
+    """
+    def __init__(self, blob_name: str, cancelled: threading.Event):
+        self.blob_name = blob_name
+        self.cancelled = cancelled
+        self.slots = threading.Semaphore(BUNDLE_PREFETCH_CHUNKS)
+        self.chunks = asyncio.Queue()
+        self.loop = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.thread.start()
+    
+    def _put(self, item, needs_slot: bool = True) -> bool:
+        if needs_slot:
+            while not self.slots.acquire(timeout=1):
+                if self.cancelled.is_set():
+                    return False
+        if self.cancelled.is_set():
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self.chunks.put_nowait, item)
+        except RuntimeError:
+            # Event loop already closed
+            return False
+        return True
+    
+    def _run(self):
+        try:
+            for chunk in streaming_container_client.download_blob(self.blob_name).chunks():
+                if not self._put(chunk):
+                    return
+            self._put(None, needs_slot=False)
+        except Exception as e:
+            self._put(e, needs_slot=False)
+    
+    async def iter_chunks(self):
+        while True:
+            item = await self.chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            self.slots.release()
+            yield item
+
+class BundleCacheWriter:
+    """Stages streamed bundle bytes as blocks of a block blob, committed at the end."""
+    def __init__(self, blob_name: str):
+        self.blob_client = container_client.get_blob_client(blob_name)
+        self.pending = []
+        self.pending_size = 0
+        self.block_ids = []
+    
+    async def write(self, data: bytes):
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= BUNDLE_CHUNK_SIZE:
+            await self._stage()
+    
+    async def _stage(self):
+        if not self.pending:
+            return
+        block_id = base64.b64encode(f"{len(self.block_ids):08d}".encode()).decode()
+        data = b"".join(self.pending)
+        self.pending = []
+        self.pending_size = 0
+        await asyncio.to_thread(self.blob_client.stage_block, block_id, data)
+        self.block_ids.append(block_id)
+    
+    async def commit(self):
+        await self._stage()
+        await asyncio.to_thread(
+            self.blob_client.commit_block_list,
+            [BlobBlock(block_id=block_id) for block_id in self.block_ids]
+        )
+
+def bundle_fingerprint(files: List[dict]) -> str:
+    digest = hashlib.sha256()
+    for f in sorted(files, key=lambda f: f["id"]):
+        digest.update(f"{f['id']}:{f['blob_name']}:{f.get('size')}\n".encode())
+    return digest.hexdigest()[:16]
+
+def bundle_blob_name(course_id: str, files: List[dict]) -> str:
+    return f"bundles/{course_id}/{bundle_fingerprint(files)}.zip"
+
+def bundle_arcnames(files: List[dict]) -> List[str]:
+    seen = {}
+    names = []
+    for f in files:
+        name = f["original_name"].replace("\\", "/").split("/")[-1] or f["id"]
+        count = seen.get(name.lower(), 0)
+        seen[name.lower()] = count + 1
+        if count:
+            stem, dot, ext = name.rpartition(".")
+            name = f"{stem} ({count}).{ext}" if dot else f"{name} ({count})"
+        names.append(name)
+    return names
+
+def invalidate_course_bundles(course_id: str):
+    if BUNDLE_CACHE_ENABLED:
+        enqueue_job("delete_stale_bundles", {"course_id": course_id})
+
+def log_bundle_download(user_id: str, course_id: str, files: List[dict]):
+    db.download_logs.insert_one({
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "course_id": course_id,
+        "file_id": None,
+        "file_ids": [f["id"] for f in files],
+        "bundle": True,
+        "downloaded_at": datetime.utcnow()
+    })
+
+async def stream_course_bundle(course_id: str, files: List[dict], user_id: str, cache_blob_name: Optional[str] = None):
+    cancelled = threading.Event()
+    prefetchers = [BlobPrefetcher(f["blob_name"], cancelled) for f in files]
+    for prefetcher in prefetchers[:BUNDLE_PREFETCH_FILES]:
+        prefetcher.start()
+    
+    cache_writer = BundleCacheWriter(cache_blob_name) if cache_blob_name else None
+    buffer = ZipStreamBuffer()
+    
+    async def emit():
+        nonlocal cache_writer
+        data = buffer.drain()
+        if data and cache_writer:
+            try:
+                await cache_writer.write(data)
+            except Exception as e:
+                print(f"Bundle cache write failed for course {course_id}: {e}")
+                cache_writer = None
+        return data
+    
+    started = time.perf_counter()
+    try:
+        with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for index, (file_info, arcname) in enumerate(zip(files, bundle_arcnames(files))):
+                uploaded_at = file_info.get("uploaded_at") or datetime.utcnow()
+                entry_info = zipfile.ZipInfo(arcname, date_time=uploaded_at.timetuple()[:6])
+                entry_info.compress_type = zipfile.ZIP_STORED
+                entry_info.external_attr = 0o644 << 16
+                entry_info.file_size = file_info.get("size") or 0
+                with archive.open(entry_info, mode="w", force_zip64=not file_info.get("size")) as entry:
+                    async for chunk in prefetchers[index].iter_chunks():
+                        entry.write(chunk)
+                        data = await emit()
+                        if data:
+                            yield data
+                if index + BUNDLE_PREFETCH_FILES < len(prefetchers):
+                    prefetchers[index + BUNDLE_PREFETCH_FILES].start()
+        # Data descriptor of the last entry plus the central directory
+        data = await emit()
+        if data:
+            yield data
+    finally:
+        cancelled.set()
+    
+    print(f"Bundle for course {course_id} streamed in {(time.perf_counter() - started) * 1000:.0f} ms ({buffer.tell()} bytes)")
+    if cache_writer:
+        try:
+            await cache_writer.commit()
+        except Exception as e:
+            print(f"Bundle cache commit failed for course {course_id}: {e}")
+    await asyncio.to_thread(log_bundle_download, user_id, course_id, files)
+
+# Typeahead suggestions
+def fold_text(value: str) -> str:
+    # Case-fold and drop accents from Latin letters ("Français" -> "francais")
+    # while leaving kana voicing marks and Hangul intact
+    decomposed = unicodedata.normalize("NFKD", value.casefold())
+    chars = []
+    for ch in decomposed:
+        if unicodedata.combining(ch) and chars and ord(chars[-1]) < 0x250:
+            continue
+        chars.append(ch)
+    return unicodedata.normalize("NFKC", "".join(chars))
+
+def is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return 0x3040 <= code <= 0x30FF or 0x3400 <= code <= 0x9FFF or 0xAC00 <= code <= 0xD7AF or 0xF900 <= code <= 0xFAFF
+
+def suggest_keys(folded: str) -> set:
+    keys = set()
+    for token in re.findall(r"\w+", folded):
+        keys.add(token)
+        # CJK titles are not space-separated, so also index from each character
+        if any(is_cjk(ch) for ch in token):
+            for start in range(1, min(len(token), 16)):
+                keys.add(token[start:])
+    return keys
+
+class SuggestIndex:
+    """Sorted prefix index of (key, rank, course_id) over course titles, solution plays and audiences."""
+    FIELDS = (("title", 1), ("solution_play", 2), ("target_audience", 3))
+    
+    def __init__(self):
+        # Full titles (rank 0) are kept apart so word entries can never crowd them out of a scan
+        self.titles = []
+        self.entries = []
+        self.course_entries = {}
+        self.search_text = {}
+    
+    def _entries_for(self, course: dict) -> List[tuple]:
+        course_id = course["_id"]
+        entries = set()
+        title = fold_text(course.get("title") or "")
+        if title:
+            entries.add((title, 0, course_id))
+        for field, rank in self.FIELDS:
+            for key in suggest_keys(fold_text(course.get(field) or "")):
+                entries.add((key, rank, course_id))
+        self.search_text[course_id] = " ".join(fold_text(course.get(field) or "") for field, _ in self.FIELDS)
+        return list(entries)
+    
+    def add(self, course: dict):
+        self.remove(course["_id"])
+        if not course.get("is_active"):
+            return
+        entries = self._entries_for(course)
+        for entry in entries:
+            bisect.insort(self._list_for(entry), entry)
+        self.course_entries[course["_id"]] = entries
+    
+    def _list_for(self, entry: tuple) -> list:
+        return self.titles if entry[1] == 0 else self.entries
+    
+    def remove(self, course_id: str):
+        for entry in self.course_entries.pop(course_id, []):
+            entries = self._list_for(entry)
+            index = bisect.bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                del entries[index]
+        self.search_text.pop(course_id, None)
+    
+    @classmethod
+    def build(cls, courses: List[dict]) -> "SuggestIndex":
+        index = cls()
+        for course in courses:
+            if course.get("is_active"):
+                entries = index._entries_for(course)
+                index.course_entries[course["_id"]] = entries
+                for entry in entries:
+                    index._list_for(entry).append(entry)
+        index.titles.sort()
+        index.entries.sort()
+        return index
+    
+    def _scan(self, prefix: str, accept=None):
+        # SUGGEST_SCAN_LIMIT bounds how many accepted entries are examined per list, not how many
+        # results are returned; entries rejected by the filter do not count towards it
+        for entries in (self.titles, self.entries):
+            examined = 0
+            for index in range(bisect.bisect_left(entries, (prefix,)), len(entries)):
+                entry = entries[index]
+                if not entry[0].startswith(prefix):
+                    break
+                if accept and not accept(entry[2]):
+                    continue
+                yield entry
+                examined += 1
+                if examined >= SUGGEST_SCAN_LIMIT:
+                    break
+    
+    def search(self, query: str, limit: int, accept=None) -> List[str]:
+        folded = fold_text(query).strip()
+        if not folded:
+            return []
+        best = {}
+        
+        def consider(key, rank, course_id):
+            score = (rank, len(key))
+            if course_id not in best or score < best[course_id]:
+                best[course_id] = score
+        
+        for key, rank, course_id in self._scan(folded, accept):
+            consider(key, rank, course_id)
+        
+        # Multi-word queries: prefix-match the last word, require the others
+        tokens = re.findall(r"\w+", folded)
+        if len(tokens) > 1:
+            for key, rank, course_id in self._scan(tokens[-1], accept):
+                text = self.search_text.get(course_id, "")
+                if all(token in text for token in tokens[:-1]):
+                    consider(key, rank + 1, course_id)
+        
+        return [course_id for course_id, _ in heapq.nsmallest(limit, best.items(), key=lambda item: item[1])]
+
+def course_suggestion(course: dict) -> dict:
+    return {
+        "id": course["_id"],
+        "title": course.get("title"),
+        "language": course.get("language"),
+        "solution_play": course.get("solution_play"),
+        "course_type": course.get("course_type")
+    }
+
+# Catalog replica
+CATALOG_FILTER_FIELDS = ["category", "solution_area", "solution_play", "course_type", "level", "language"]
+
+class CatalogReplica:
+    """Read-only in-memory copy of db.courses, indexed by the catalog filter fields."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.thread = None
+        # Insertion-ordered (load order, then new courses appended), so
+        # iterating it gives the catalog order without sorting
+        self.courses = {}
+        self.search_text = {}
+        self.sizes = {}
+        self.indexes = {field: {} for field in CATALOG_FILTER_FIELDS}
+        self.active_ids = set()
+        self.suggestions = SuggestIndex()
+        self.loaded = False
+        self.mode = "stopped"
+        self.resume_token = None
+        self.last_synced_at = None
+        self.lag_ms = None
+        self.events_applied = 0
+        self.resyncs = 0
+        # Newest updated_at seen; polling only fetches courses changed since
+        self.high_water = None
+        # Version of the replica contents, used to build catalog ETags
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.last_error = None
+    
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="catalog-replica", daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        self.stopped.set()
+    
+    def is_fresh(self) -> bool:
+        return (
+            self.loaded
+            and self.last_synced_at is not None
+            and time.time() - self.last_synced_at <= CATALOG_MAX_STALENESS_SECONDS
+        )
+    
+    def _index(self, course: dict, add: bool):
+        course_id = course["_id"]
+        if not course.get("is_active"):
+            return
+        for field in CATALOG_FILTER_FIELDS:
+            ids = self.indexes[field].setdefault(course.get(field), set())
+            if add:
+                ids.add(course_id)
+            else:
+                ids.discard(course_id)
+                if not ids:
+                    del self.indexes[field][course.get(field)]
+        if add:
+            self.active_ids.add(course_id)
+        else:
+            self.active_ids.discard(course_id)
+    
+    def _upsert(self, course: dict, update_suggestions: bool = True):
+        with self.lock:
+            updated_at = course.get("updated_at")
+            if updated_at and (self.high_water is None or updated_at > self.high_water):
+                self.high_water = updated_at
+            previous = self.courses.get(course["_id"])
+            if previous == course:
+                return
+            if previous:
+                self._index(previous, add=False)
+            self.courses[course["_id"]] = course
+            self.search_text[course["_id"]] = f"{course.get('title') or ''}\n{course.get('description') or ''}".casefold()
+            self.version += 1
+            self.sizes[course["_id"]] = len(bson_encode(course))
+            self._index(course, add=True)
+            if update_suggestions:
+                self.suggestions.add(course)
+    
+    def _remove(self, course_id: str):
+        with self.lock:
+            previous = self.courses.pop(course_id, None)
+            if previous:
+                self._index(previous, add=False)
+                self.version += 1
+            self.search_text.pop(course_id, None)
+            self.sizes.pop(course_id, None)
+            self.suggestions.remove(course_id)
+    
+    def resync(self):
+        courses = list(db.courses.find())
+        with self.lock:
+            unchanged = (
+                self.loaded
+                and len(courses) == len(self.courses)
+                and all(self.courses.get(course["_id"]) == course for course in courses)
+            )
+            if unchanged:
+                # Keep the version (and so every catalog ETag) and skip the rebuild
+                self.resyncs += 1
+                self.last_synced_at = time.time()
+                return
+        # Build the suggestion index before taking the lock so reads continue meanwhile
+        suggestions = SuggestIndex.build(courses)
+        with self.lock:
+            version = self.version
+            self.courses = {}
+            self.search_text = {}
+            self.sizes = {}
+            self.indexes = {field: {} for field in CATALOG_FILTER_FIELDS}
+            self.active_ids = set()
+            for course in courses:
+                self._upsert(course, update_suggestions=False)
+            self.version = version + 1
+            self.suggestions = suggestions
+            self.loaded = True
+            self.resyncs += 1
+            self.last_synced_at = time.time()
+    
+    def refresh(self, course_id: str):
+        # Apply this process's own writes immediately rather than waiting
+        # for the change stream
+        if not self.loaded:
+            return
+        course = db.courses.find_one({"_id": course_id})
+        if course:
+            self._upsert(course)
+        else:
+            self._remove(course_id)
+    
+    def _apply_change(self, change: dict) -> bool:
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            if change.get("fullDocument"):
+                self._upsert(change["fullDocument"])
+            else:
+                self._remove(change["documentKey"]["_id"])
+        elif operation == "delete":
+            self._remove(change["documentKey"]["_id"])
+        elif operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            return False
+        
+        if change.get("clusterTime"):
+            applied_at = datetime.now(timezone.utc)
+            self.lag_ms = round((applied_at - change["clusterTime"].as_datetime()).total_seconds() * 1000, 1)
+        self.events_applied += 1
+        return True
+    
+    def _follow_change_stream(self):
+        with db.courses.watch(
+            full_document="updateLookup",
+            resume_after=self.resume_token,
+            max_await_time_ms=1000
+        ) as stream:
+            if self.resume_token is None:
+                # The stream is already open, so changes made during the load
+                # are replayed afterwards (applying them is idempotent)
+                self.resync()
+                self.resume_token = stream.resume_token
+            self.mode = "change_stream"
+            while not self.stopped.is_set():
+                change = stream.try_next()
+                if change and not self._apply_change(change):
+                    self.resume_token = None
+                    return
+                self.resume_token = stream.resume_token
+                self.last_synced_at = time.time()
+    
+    def _poll_changes(self):
+        # Every app write sets updated_at; the overlap absorbs clock skew
+        # between app servers. Courses are never hard-deleted by the app, so a
+        # count mismatch (external delete) falls back to a full resync.
+        since = self.high_water - timedelta(seconds=CATALOG_POLL_OVERLAP_SECONDS)
+        for course in db.courses.find({"updated_at": {"$gte": since}}):
+            self._upsert(course)
+        if db.courses.estimated_document_count() != len(self.courses):
+            self.resync()
+        self.last_synced_at = time.time()
+    
+    def _poll(self):
+        self.mode = "polling"
+        while not self.stopped.is_set():
+            try:
+                if self.loaded and self.high_water is not None:
+                    self._poll_changes()
+                else:
+                    self.resync()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Catalog replica resync failed: {e}")
+            self.stopped.wait(CATALOG_POLL_SECONDS)
+    
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self._follow_change_stream()
+            except OperationFailure as e:
+                self.last_error = str(e)
+                if e.code == 40573:
+                    # Change streams need a replica set; fall back to polling
+                    print("Catalog replica: change streams unavailable, polling instead")
+                    self._poll()
+                    return
+                # Resume token no longer valid (e.g. oplog rolled over): full resync
+                print(f"Catalog replica: change stream failed, resyncing: {e}")
+                self.resume_token = None
+                self.stopped.wait(1)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Catalog replica: change stream error, retrying: {e}")
+                self.stopped.wait(CATALOG_RETRY_SECONDS)
+        self.mode = "stopped"
+    
+    def get(self, course_id: str) -> Optional[dict]:
+        with self.lock:
+            return self.courses.get(course_id)
+    
+    def find(self, filters: dict, search: Optional[str] = None) -> List[dict]:
+        # Linear in the catalog size, so callers run it off the event loop.
+        # search is a literal, case-insensitive substring (never a regex).
+        needle = search.casefold() if search else None
+        with self.lock:
+            candidates = self.active_ids
+            for field, value in filters.items():
+                candidates = candidates & self.indexes[field].get(value, set())
+            return [
+                course for course_id, course in self.courses.items()
+                if course_id in candidates and (needle is None or needle in self.search_text[course_id])
+            ]
+    
+    def suggest(self, query: str, limit: int, language: Optional[str] = None) -> List[dict]:
+        with self.lock:
+            accept = None
+            if language:
+                accept = lambda course_id: self.courses[course_id].get("language") == language
+            return [
+                course_suggestion(self.courses[course_id])
+                for course_id in self.suggestions.search(query, limit, accept)
+            ]
+    
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": CATALOG_REPLICA_ENABLED,
+                "mode": self.mode,
+                "loaded": self.loaded,
+                "fresh": self.is_fresh(),
+                "courses": len(self.courses),
+                "active_courses": len(self.active_ids),
+                "suggestion_entries": len(self.suggestions.titles) + len(self.suggestions.entries),
+                "memory_bytes": sum(self.sizes.values()),
+                "staleness_seconds": round(time.time() - self.last_synced_at, 3) if self.last_synced_at else None,
+                "replication_lag_ms": self.lag_ms,
+                "events_applied": self.events_applied,
+                "resyncs": self.resyncs,
+                "last_error": self.last_error
+            }
+
+catalog = CatalogReplica()
+
+def catalog_etag(path: str, params: Optional[dict] = None) -> str:
+    # Only known, normalised parameters go into the key so unrelated query strings share one entry
+    canonical = json.dumps(sorted((params or {}).items()), separators=(",", ":"))
+    digest = hashlib.sha1(f"{path}?{canonical}".encode()).hexdigest()[:16]
+    return f'W/"catalog-{catalog.epoch}-{catalog.version}-{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def course_response(course: dict) -> dict:
+    course = dict(course)
+    course["id"] = course.pop("_id")
+    return course
+
+# Analytics query guardrails
+def analytics_aggregate(collection: str, pipeline: List[dict]) -> List[dict]:
+    return list(analytics_db[collection].aggregate(
+        pipeline,
+        maxTimeMS=ANALYTICS_MAX_TIME_MS,
+        allowDiskUse=ANALYTICS_ALLOW_DISK_USE,
+        batchSize=ANALYTICS_BATCH_SIZE
+    ))
+
+def analytics_count(collection: str, query: dict) -> int:
+    return analytics_db[collection].count_documents(query, maxTimeMS=ANALYTICS_MAX_TIME_MS)
+
+def guarded_query(section: str, timed_out: List[str], query, default=None):
+    # A section that hits maxTimeMS (or needs disk it may not use) is left
+    # out of the response rather than failing the whole endpoint
+    try:
+        return query()
+    except ExecutionTimeout:
+        timed_out.append(section)
+    except OperationFailure as e:
+        if e.code != 292:  # QueryExceededMemoryLimitNoDiskUseAllowed
+            raise
+        timed_out.append(section)
+    print(f"Analytics section {section} exceeded its query limits")
+    return default
+
+def with_timeouts(result: dict, timed_out: List[str]) -> dict:
+    if timed_out:
+        result["partial"] = True
+        result["timed_out"] = timed_out
+    return result
+
+# Entitlements: approved and pending course ids are kept on the user
+# document, so they load with the principal in get_current_user
+def refresh_entitlements(user_id: str) -> dict:
+    # Both sets are derived only from access_requests. The write is
+    # conditional on entitlements_version (read before access_requests), so
+    # a refresh computed from an older read can never overwrite a newer one.
+    while True:
+        user = db.users.find_one({"_id": user_id}, {"entitlements_version": 1})
+        if not user:
+            return {"entitled_course_ids": [], "pending_course_ids": []}
+        version = user.get("entitlements_version")
+        
+        course_ids = {"approved": [], "pending": []}
+        for row in db.access_requests.aggregate([
+            {"$match": {"user_id": user_id, "status": {"$in": ["pending", "approved"]}}},
+            {"$group": {"_id": "$status", "course_ids": {"$addToSet": "$course_id"}}}
+        ]):
+            course_ids[row["_id"]] = row["course_ids"]
+        entitlements = {
+            "entitled_course_ids": course_ids["approved"],
+            "pending_course_ids": course_ids["pending"]
+        }
+        result = db.users.update_one(
+            {"_id": user_id, "entitlements_version": version},
+            {"$set": entitlements, "$inc": {"entitlements_version": 1}}
+        )
+        if result.matched_count:
+            return entitlements
+
+def user_entitlements(user: dict) -> tuple:
+    # Users created before entitlements existed are backfilled on first use
+    if "entitled_course_ids" not in user:
+        user.update(refresh_entitlements(user["_id"]))
+    return set(user["entitled_course_ids"]), set(user.get("pending_course_ids", []))
+
+def course_summaries(course_ids) -> dict:
+    course_ids = list(set(course_ids))
+    if catalog.is_fresh():
+        courses = [c for c in (catalog.get(course_id) for course_id in course_ids) if c]
+    else:
+        courses = db.courses.find({"_id": {"$in": course_ids}}, {"title": 1, "is_active": 1})
+    return {c["_id"]: {"title": c["title"], "is_active": c.get("is_active", False)} for c in courses}
+
+def as_utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# Response compression
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+    
+    best, best_quality = None, 0.0
+    for encoding in (["br"] if brotli else []) + ["gzip"]:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress_body(body: bytes, encoding: str, cached: bool) -> bytes:
+    # Cached bodies are compressed once per change, so spend a little more CPU on them
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_CACHED_BROTLI_QUALITY if cached else COMPRESSION_BROTLI_QUALITY)
+    compressor = zlib.compressobj(COMPRESSION_CACHED_GZIP_LEVEL if cached else COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+class StreamCompressor:
+    """Incremental compressor that flushes after each chunk so clients see data as it is produced."""
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self.compressor.process(data)
+            return out + (self.compressor.finish() if final else self.compressor.flush())
+        out = self.compressor.compress(data)
+        return out + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+compressed_cache = OrderedDict()
+compressed_cache_state = {"bytes": 0}
+compression_stats = {}
+
+def cache_compressed(key: tuple, body: bytes):
+    if len(body) > COMPRESSION_CACHE_MAX_BYTES:
+        return
+    if key in compressed_cache:
+        compressed_cache_state["bytes"] -= len(compressed_cache.pop(key))
+    compressed_cache[key] = body
+    compressed_cache_state["bytes"] += len(body)
+    while compressed_cache_state["bytes"] > COMPRESSION_CACHE_MAX_BYTES:
+        _, evicted = compressed_cache.popitem(last=False)
+        compressed_cache_state["bytes"] -= len(evicted)
+
+def record_compression(scope: dict, encoding: str, bytes_in: int, bytes_out: int, elapsed: float, cache_hit: bool):
+    route = scope.get("route")
+    path = getattr(route, "path", scope["path"])
+    stats = compression_stats.setdefault(f"{scope['method']} {path}", {
+        "responses": 0, "bytes_in": 0, "bytes_out": 0, "compress_ms": 0.0, "cache_hits": 0, "encodings": {}
+    })
+    stats["responses"] += 1
+    stats["bytes_in"] += bytes_in
+    stats["bytes_out"] += bytes_out
+    stats["compress_ms"] += elapsed * 1000
+    stats["cache_hits"] += cache_hit
+    stats["encodings"][encoding] = stats["encodings"].get(encoding, 0) + 1
+
+class CompressionResponder:
+    def __init__(self, scope: dict, send, encoding: str):
+        self.scope = scope
+        self.downstream = send
+        self.encoding = encoding
+        self.start_message = None
+        self.stream = None
+        self.passthrough = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.elapsed = 0.0
+    
+    async def send(self, message: dict):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+        
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        
+        if self.stream is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                self.start_message["status"] < 200
+                or self.start_message["status"] in (204, 304)
+                or "content-encoding" in headers
+                or not content_type.startswith(COMPRESSIBLE_TYPES)
+                or (not more_body and len(body) < COMPRESSION_MIN_SIZE)
+            ):
+                self.passthrough = True
+                await self.downstream(self.start_message)
+                await self.downstream(message)
+                return
+            
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            
+            if not more_body:
+                etag = headers.get("etag")
+                key = (etag, self.encoding)
+                started = time.perf_counter()
+                compressed = compressed_cache.get(key) if etag else None
+                cache_hit = compressed is not None
+                if cache_hit:
+                    compressed_cache.move_to_end(key)
+                else:
+                    compressed = await asyncio.to_thread(compress_body, body, self.encoding, bool(etag))
+                    if etag:
+                        cache_compressed(key, compressed)
+                record_compression(self.scope, self.encoding, len(body), len(compressed), time.perf_counter() - started, cache_hit)
+                headers["Content-Length"] = str(len(compressed))
+                await self.downstream(self.start_message)
+                await self.downstream({"type": "http.response.body", "body": compressed})
+                return
+            
+            del headers["Content-Length"]
+            self.stream = StreamCompressor(self.encoding)
+            await self.downstream(self.start_message)
+        
+        started = time.perf_counter()
+        compressed = self.stream.compress(body, final=not more_body)
+        self.elapsed += time.perf_counter() - started
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        if not more_body:
+            record_compression(self.scope, self.encoding, self.bytes_in, self.bytes_out, self.elapsed, False)
+        await self.downstream({"type": "http.response.body", "body": compressed, "more_body": more_body})
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with the best encoding the client accepts."""
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, CompressionResponder(scope, send, encoding).send)
+
+app.add_middleware(CompressionMiddleware)
+
+# Request coalescing
+class SingleFlightCache:
+    """Runs at most one computation per key at a time and caches the result briefly."""
+    def __init__(self, ttl_seconds: int, stale_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.entries = {}
+        self.in_flight = {}
+    
+    async def get(self, key: tuple, compute):
+        entry = self.entries.get(key)
+        if entry:
+            age = time.monotonic() - entry["computed_at"]
+            if age <= self.ttl_seconds:
+                return entry["value"]
+            if age <= self.ttl_seconds + self.stale_seconds:
+                self._refresh(key, compute)
+                return entry["value"]
+        try:
+            # Shield so a disconnecting caller does not cancel the shared computation
+            return await asyncio.shield(self._refresh(key, compute))
+        except Exception:
+            # Degrade to the last known result, however old
+            if entry:
+                return entry["value"]
+            raise
+    
+    def _refresh(self, key: tuple, compute) -> asyncio.Task:
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, compute))
+            task.add_done_callback(self._log_failure)
+            self.in_flight[key] = task
+        return task
+    
+    async def _run(self, key: tuple, compute):
+        try:
+            value = await asyncio.to_thread(compute)
+            previous = self.entries.get(key)
+            if isinstance(value, dict) and value.get("partial") and previous and not previous["value"].get("partial"):
+                # Keep serving the last complete result over a partial one
+                return previous["value"]
+            self.entries.pop(key, None)
+            self.entries[key] = {"value": value, "computed_at": time.monotonic()}
+            while len(self.entries) > self.max_entries:
+                self.entries.pop(next(iter(self.entries)))
+            return value
+        finally:
+            self.in_flight.pop(key, None)
+    
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"Cached computation failed: {task.exception()}")
+
+analytics_cache = SingleFlightCache(ANALYTICS_CACHE_TTL_SECONDS, ANALYTICS_CACHE_STALE_SECONDS, ANALYTICS_CACHE_MAX_ENTRIES)
+
+# Background job queue
+def enqueue_job(job_type: str, payload: dict, idempotency_key: Optional[str] = None, max_attempts: Optional[int] = None) -> str:
+    now = datetime.utcnow()
+    job = {
+        "_id": str(uuid.uuid4()),
+        "type": job_type,
+        "payload": payload,
+        "status": "pending",
+        "attempts": 0,
+        "max_attempts": max_attempts or JOB_MAX_ATTEMPTS,
+        "run_at": now,
+        "created_at": now,
+        "updated_at": now
+    }
+    if idempotency_key:
+        job["idempotency_key"] = idempotency_key
+    try:
+        db.jobs.insert_one(job)
+    except DuplicateKeyError:
+        existing = db.jobs.find_one({"idempotency_key": idempotency_key}, {"_id": 1})
+        return existing["_id"] if existing else None
+    return job["_id"]
+
+def claim_next_job():
+    now = datetime.utcnow()
+    return db.jobs.find_one_and_update(
+        {
+            "$or": [
+                {"status": "pending", "run_at": {"$lte": now}},
+                # Reclaim jobs whose worker died mid-run
+                {"status": "running", "locked_until": {"$lt": now}}
+            ]
+        },
+        {
+            "$set": {
+                "status": "running",
+                # Owned by this claim; updates from an earlier, expired claim no longer match
+                "lock_token": str(uuid.uuid4()),
+                "locked_until": now + timedelta(seconds=JOB_LOCK_SECONDS),
+                "started_at": now,
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("run_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def renew_job_lease(job: dict, finished: threading.Event):
+    # Heartbeat: keep extending the lease while the handler runs
+    while not finished.wait(JOB_LOCK_SECONDS / 3):
+        try:
+            result = db.jobs.update_one(
+                {"_id": job["_id"], "lock_token": job["lock_token"]},
+                {"$set": {"locked_until": datetime.utcnow() + timedelta(seconds=JOB_LOCK_SECONDS)}}
+            )
+            if result.matched_count == 0:
+                print(f"Job {job['_id']} ({job['type']}) lost its lease")
+                return
+        except Exception as e:
+            print(f"Job {job['_id']} lease renewal failed: {e}")
+
+def finish_job(job: dict, update: dict):
+    result = db.jobs.update_one(
+        {"_id": job["_id"], "lock_token": job["lock_token"]},
+        {"$set": update, "$unset": {"locked_until": "", "lock_token": ""}}
+    )
+    if result.matched_count == 0:
+        print(f"Job {job['_id']} ({job['type']}) was reclaimed by another worker; result discarded")
+
+def run_job(job: dict):
+    started = time.perf_counter()
+    finished = threading.Event()
+    heartbeat = threading.Thread(target=renew_job_lease, args=(job, finished), daemon=True)
+    heartbeat.start()
+    try:
+        if job["attempts"] > job["max_attempts"]:
+            raise RuntimeError("Job exceeded its maximum attempts")
+        handler = JOB_HANDLERS.get(job["type"])
+        if not handler:
+            raise RuntimeError(f"Unknown job type: {job['type']}")
+        result = handler(job.get("payload", {}))
+    except Exception as e:
+        finished.set()
+        now = datetime.utcnow()
+        update = {"last_error": str(e), "updated_at": now}
+        if job["attempts"] >= job["max_attempts"]:
+            update.update({"status": "failed", "finished_at": now})
+        else:
+            retry_delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+            update.update({"status": "pending", "run_at": now + timedelta(seconds=retry_delay)})
+        finish_job(job, update)
+        print(f"Job {job['_id']} ({job['type']}) attempt {job['attempts']} failed: {e}")
+        return
+    
+    finished.set()
+    now = datetime.utcnow()
+    finish_job(job, {
+        "status": "succeeded",
+        "result": result,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "finished_at": now,
+        "updated_at": now
+    })
+
+async def job_worker(worker_id: int):
+    while True:
+        try:
+            job = await asyncio.to_thread(claim_next_job)
+        except Exception as e:
+            print(f"Job worker {worker_id} could not claim a job: {e}")
+            job = None
+        if not job:
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            continue
+        try:
+            await asyncio.to_thread(run_job, job)
+        except Exception as e:
+            print(f"Job worker {worker_id} could not record job {job['_id']}: {e}")
+
+async def periodic_job_scheduler(job_type: str, interval_minutes: int):
+    interval_seconds = interval_minutes * 60
+    while True:
+        # One job per interval across all replicas
+        window = int(time.time() // interval_seconds)
+        try:
+            await asyncio.to_thread(enqueue_job, job_type, {}, f"{job_type}:{window}")
+        except Exception as e:
+            print(f"Could not schedule {job_type} job: {e}")
+        await asyncio.sleep(interval_seconds)
+
+def delete_blob_if_exists(blob_name: str) -> bool:
+    invalidate_sas_urls(blob_name)
+    try:
+        container_client.delete_blob(blob_name)
+        return True
+    except ResourceNotFoundError:
+        return False
+
+def job_delete_blob(payload: dict) -> dict:
+    if not container_client:
+        raise RuntimeError("Azure storage not configured")
+    return {"deleted": delete_blob_if_exists(payload["blob_name"])}
+
+def job_delete_course_blobs(payload: dict) -> dict:
+    if not container_client:
+        raise RuntimeError("Azure storage not configured")
+    course_id = payload["course_id"]
+    course = db.courses.find_one({"_id": course_id}, {"is_active": 1})
+    if course and course.get("is_active"):
+        return {"deleted": 0, "skipped": "course is active"}
+    
+    deleted = 0
+    for prefix in (f"courses/{course_id}/", f"bundles/{course_id}/"):
+        for blob in container_client.list_blobs(name_starts_with=prefix):
+            deleted += delete_blob_if_exists(blob.name)
+    return {"deleted": deleted}
+
+def job_delete_stale_bundles(payload: dict) -> dict:
+    if not container_client:
+        raise RuntimeError("Azure storage not configured")
+    course_id = payload["course_id"]
+    course = db.courses.find_one({"_id": course_id}, {"is_active": 1, "files": 1})
+    current = bundle_blob_name(course_id, course.get("files", [])) if course and course.get("is_active") else None
+    
+    deleted = 0
+    for blob in container_client.list_blobs(name_starts_with=f"bundles/{course_id}/"):
+        if blob.name != current:
+            deleted += delete_blob_if_exists(blob.name)
+    return {"deleted": deleted}
+
+def job_sweep_orphan_blobs(payload: dict) -> dict:
+    if not container_client:
+        raise RuntimeError("Azure storage not configured")
+    # Skip recent blobs: an upload writes the blob before the course document
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=ORPHAN_GRACE_HOURS)
+    courses = {
+        c["_id"]: c
+        for c in db.courses.find({}, {"is_active": 1, "files.id": 1, "files.blob_name": 1, "files.size": 1})
+    }
+    referenced = set()
+    current_bundles = set()
+    for course_id, course in courses.items():
+        if course.get("is_active"):
+            files = course.get("files", [])
+            referenced.update(f["blob_name"] for f in files)
+            current_bundles.add(bundle_blob_name(course_id, files))
+    
+    enqueued = 0
+    for prefix, keep in (("courses/", referenced), ("bundles/", current_bundles)):
+        for blob in container_client.list_blobs(name_starts_with=prefix):
+            if blob.name in keep or blob.last_modified > cutoff:
+                continue
+            enqueue_job("delete_blob", {"blob_name": blob.name}, f"delete_blob:{blob.name}")
+            enqueued += 1
+    return {"enqueued": enqueued}
+
+# Download log retention
+def start_of_day(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def download_rollup_watermark(database=db) -> Optional[datetime]:
+    # Start of the first day whose raw events have not been rolled up yet
+    meta = database.download_rollups.find_one({"_id": "watermark"})
+    return meta["rolled_through"] if meta else None
+
+def archive_download_day(day: datetime, day_filter: dict):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as archive:
+        events = analytics_db.download_logs.find(day_filter).sort("downloaded_at", ASCENDING).batch_size(ANALYTICS_BATCH_SIZE)
+        for event in events:
+            archive.write((json.dumps(event, default=str) + "\n").encode())
+    blob_name = f"archives/download_logs/{day:%Y/%m/%d}.jsonl.gz"
+    container_client.get_blob_client(blob_name).upload_blob(buffer.getvalue(), overwrite=True)
+
+def rollup_download_day(day: datetime):
+    date = day.strftime("%Y-%m-%d")
+    day_filter = {"downloaded_at": {"$gte": day, "$lt": day + timedelta(days=1)}}
+    
+    # Idempotent: bucket ids are deterministic and replaced on re-run
+    db.download_logs.aggregate([
+        {"$match": day_filter},
+        {
+            "$group": {
+                "_id": "$course_id",
+                "count": {"$sum": 1},
+                "bundle_count": {"$sum": {"$cond": [{"$eq": ["$bundle", True]}, 1, 0]}},
+                "users": {"$addToSet": "$user_id"}
+            }
+        },
+        {
+            "$project": {
+                "_id": {"$concat": [date, ":", "$_id"]},
+                "date": date,
+                "day": day,
+                "course_id": "$_id",
+                "count": 1,
+                "bundle_count": 1,
+                "unique_users": {"$size": "$users"}
+            }
+        },
+        {"$merge": {"into": "download_daily", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+    
+    if DOWNLOAD_LOG_ARCHIVE_ENABLED:
+        if not container_client:
+            raise RuntimeError("Azure storage not configured for download log archival")
+        archive_download_day(day, day_filter)
+    
+    # Raw rows only become eligible for TTL expiry once rolled up (and archived)
+    db.download_logs.update_many(
+        day_filter,
+        {"$set": {"expire_at": day + timedelta(days=1 + DOWNLOAD_LOG_RAW_RETENTION_DAYS)}}
+    )
+
+def job_rollup_download_logs(payload: dict) -> dict:
+    day = download_rollup_watermark()
+    if day is None:
+        first = db.download_logs.find_one({}, {"downloaded_at": 1}, sort=[("downloaded_at", ASCENDING)])
+        if not first:
+            return {"days": 0}
+        day = start_of_day(first["downloaded_at"])
+    
+    # Leave the current day (and a short delay past midnight) for late writes
+    cutoff = start_of_day(datetime.utcnow() - timedelta(minutes=DOWNLOAD_ROLLUP_DELAY_MINUTES))
+    days = 0
+    while day < cutoff and days < DOWNLOAD_ROLLUP_MAX_DAYS_PER_RUN:
+        rollup_download_day(day)
+        day += timedelta(days=1)
+        days += 1
+        db.download_rollups.update_one(
+            {"_id": "watermark"},
+            {"$set": {"rolled_through": day, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+    return {"days": days, "rolled_through": day}
+
+JOB_HANDLERS = {
+    "delete_blob": job_delete_blob,
+    "delete_course_blobs": job_delete_course_blobs,
+    "delete_stale_bundles": job_delete_stale_bundles,
+    "sweep_orphan_blobs": job_sweep_orphan_blobs,
+    "rollup_download_logs": job_rollup_download_logs,
+}
+
+# Startup / dependency checks
+def check_mongodb():
+    client.admin.command('ping')
+
+def check_storage():
+    # Read-only: readiness probes must never write to storage
+    if not container_client:
+        raise RuntimeError("Azure storage not configured")
+    if not container_client.exists():
+        raise RuntimeError(f"Container {AZURE_CONTAINER_NAME} does not exist")
+
+def ensure_storage_container():
+    if not container_client:
+        raise RuntimeError("Azure storage not configured")
+    if not container_client.exists():
+        container_client.create_container()
+
+def seed_admin_user():
+    admin = db.users.find_one({"email": "admin@skillingbox.com"})
+    if not admin:
+        admin_id = str(uuid.uuid4())
+        db.users.insert_one({
+            "_id": admin_id,
+            "email": "admin@skillingbox.com",
+            "password": hash_password("admin123"),
+            "full_name": "System Admin",
+            "organization": "Skilling Box",
+            "domain": "skillingbox.com",
+            "role": "admin",
+            "is_approved": True,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        })
+        print("Admin user created: admin@skillingbox.com / admin123")
+
+INDEX_SPECS = [
+    ("jobs", [("status", ASCENDING), ("run_at", ASCENDING)], {}),
+    ("jobs", "idempotency_key", {"unique": True, "sparse": True}),
+    ("jobs", "finished_at", {"expireAfterSeconds": JOB_RETENTION_DAYS * 86400}),
+    ("courses", "updated_at", {}),
+    ("access_requests", [("user_id", ASCENDING), ("status", ASCENDING)], {}),
+    ("executions", [("user_id", ASCENDING), ("status", ASCENDING), ("execution_date", ASCENDING)], {}),
+    ("download_logs", "downloaded_at", {}),
+    ("download_logs", "expire_at", {"expireAfterSeconds": 0}),
+    ("download_daily", "day", {}),
+    ("download_daily", [("course_id", ASCENDING), ("day", ASCENDING)], {}),
+]
+pending_indexes = set(range(len(INDEX_SPECS)))
+
+def ensure_indexes() -> int:
+    """Create every index still pending, each independently; returns how many remain pending."""
+    for position in sorted(pending_indexes):
+        collection, keys, options = INDEX_SPECS[position]
+        try:
+            db[collection].create_index(keys, **options)
+            pending_indexes.discard(position)
+        except Exception as e:
+            print(f"Index warning - {collection} {keys} not created: {e}")
+    return len(pending_indexes)
+
+async def run_dependency_check(name: str, check) -> bool:
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(check)
+        ok, error = True, None
+    except Exception as e:
+        ok, error = False, str(e)
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    dependency_status[name] = {
+        "ok": ok,
+        "checked_at": datetime.utcnow(),
+        "latency_ms": latency_ms,
+        "error": error
+    }
+    return ok
+
+async def refresh_dependencies(names: List[str]):
+    checks = {"mongodb": check_mongodb, "storage": check_storage}
+    await asyncio.gather(*(run_dependency_check(name, checks[name]) for name in names))
+    # Indexes missed at boot (MongoDB down, option conflicts) are retried until all exist
+    if pending_indexes and dependency_status["mongodb"]["ok"]:
+        await asyncio.to_thread(ensure_indexes)
+
+def report_startup_check(name: str, ok: bool):
+    state = dependency_status[name]
+    if ok:
+        print(f"Startup: {name} check succeeded in {state['latency_ms']} ms")
+    else:
+        print(f"Startup warning - {name} check failed after {state['latency_ms']} ms: {state['error']}")
+
+async def warm_up_mongodb():
+    # Seeding, indexes and the catalog replica only need MongoDB, so they never wait on storage
+    mongo_ok = await run_dependency_check("mongodb", check_mongodb)
+    report_startup_check("mongodb", mongo_ok)
+    
+    if mongo_ok:
+        seed_started = time.perf_counter()
+        try:
+            await asyncio.to_thread(seed_admin_user)
+            print(f"Startup: admin seeding finished in {(time.perf_counter() - seed_started) * 1000:.1f} ms")
+        except Exception as e:
+            print(f"Startup warning - admin seeding failed: {e}")
+        
+        index_started = time.perf_counter()
+        pending = await asyncio.to_thread(ensure_indexes)
+        print(f"Startup: index creation finished in {(time.perf_counter() - index_started) * 1000:.1f} ms, {pending} pending")
+    
+    if CATALOG_REPLICA_ENABLED:
+        catalog.start()
+
+async def warm_up_storage():
+    storage_ok = await run_dependency_check("storage", ensure_storage_container)
+    report_startup_check("storage", storage_ok)
+
+async def warm_up_dependencies():
+    started = time.perf_counter()
+    await asyncio.gather(warm_up_mongodb(), warm_up_storage())
+    print(f"Startup: background warm-up finished in {(time.perf_counter() - started) * 1000:.1f} ms")
 
 # Routes
 @app.get("/api/health")
+@app.get("/api/health/live")
 async def health_check():
+    # Liveness only: never touches the database or storage
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/api/health/ready")
+async def readiness_check():
+    now = datetime.utcnow()
+    stale = [
+        name for name, state in dependency_status.items()
+        if state["checked_at"] is not None
+        and (now - state["checked_at"]).total_seconds() > READINESS_RECHECK_SECONDS
+    ]
+    if stale and (readiness_refresh["task"] is None or readiness_refresh["task"].done()):
+        # Answer from the cached status; a slow dependency must not make the probe time out
+        readiness_refresh["task"] = asyncio.ensure_future(refresh_dependencies(stale))
+    
+    ready = all(state["ok"] for state in dependency_status.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "dependencies": {
+                name: {
+                    "ok": state["ok"],
+                    "checked_at": state["checked_at"].isoformat() if state["checked_at"] else None,
+                    "latency_ms": state["latency_ms"],
+                    "error": state["error"]
+                }
+                for name, state in dependency_status.items()
+            },
+            "timestamp": now.isoformat()
+        }
+    )
+
 # Auth Routes
 @app.post("/api/auth/register", response_model=TokenResponse)
 async def register(user_data: UserRegister):
@@ -348,19 +1859,24 @@ async def get_me(user: dict = Depends(get_current_user)):
     )
 
 # Metadata Routes
+METADATA = {
+    "solution_areas": SOLUTION_AREAS,
+    "solution_plays": SOLUTION_PLAYS,
+    "course_types": COURSE_TYPES,
+    "levels": LEVELS,
+    "languages": LANGUAGES,
+    "roles": ROLES,
+    "content_categories": CONTENT_CATEGORIES,
+    "file_types": FILE_TYPES,
+    "user_roles": USER_ROLES
+}
+METADATA_ETAG = f'W/"metadata-{hashlib.sha1(json.dumps(METADATA, sort_keys=True).encode()).hexdigest()[:16]}"'
+
 @app.get("/api/metadata")
-async def get_metadata():
-    return {
-        "solution_areas": SOLUTION_AREAS,
-        "solution_plays": SOLUTION_PLAYS,
-        "course_types": COURSE_TYPES,
-        "levels": LEVELS,
-        "languages": LANGUAGES,
-        "roles": ROLES,
-        "content_categories": CONTENT_CATEGORIES,
-        "file_types": FILE_TYPES,
-        "user_roles": USER_ROLES
-    }
+async def get_metadata(request: Request):
+    if etag_matches(request, METADATA_ETAG):
+        return Response(status_code=304, headers={"ETag": METADATA_ETAG})
+    return JSONResponse(METADATA, headers={"ETag": METADATA_ETAG, "Cache-Control": "no-cache"})
 
 # Course Routes
 @app.post("/api/courses")
@@ -381,10 +1897,13 @@ async def create_course(
         "is_active": True
     }
     db.courses.insert_one(course)
+    catalog.refresh(course_id)
     return {"id": course_id, "message": "Course created successfully"}
 
 @app.get("/api/courses")
 async def get_courses(
+    request: Request,
+    response: Response,
     category: Optional[str] = None,
     solution_area: Optional[str] = None,
     solution_play: Optional[str] = None,
@@ -395,6 +1914,33 @@ async def get_courses(
     page: int = 1,
     limit: int = 20
 ):
+    filters = {
+        "category": category,
+        "solution_area": solution_area,
+        "solution_play": solution_play,
+        "course_type": course_type,
+        "level": level,
+        "language": language
+    }
+    page = max(page, 1)
+    limit = min(max(limit, 1), CATALOG_MAX_PAGE_SIZE)
+    if catalog.is_fresh():
+        # Taken before reading so the ETag never claims a newer version than the body
+        etag = catalog_etag(request.url.path, {**{k: v for k, v in filters.items() if v}, "search": search or "", "page": page, "limit": limit})
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        matches = await asyncio.to_thread(catalog.find, {k: v for k, v in filters.items() if v}, search)
+        total = len(matches)
+        start = (page - 1) * limit
+        return {
+            "courses": [course_response(c) for c in matches[start:start + limit]],
+            "total": total,
+            "page": page,
+            "pages": (total + limit - 1) // limit
+        }
+    
     query = {"is_active": True}
     
     if category:
@@ -411,8 +1957,8 @@ async def get_courses(
         query["language"] = language
     if search:
         query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
+            {"title": {"$regex": re.escape(search), "$options": "i"}},
+            {"description": {"$regex": re.escape(search), "$options": "i"}}
         ]
     
     total = db.courses.count_documents(query)
@@ -428,13 +1974,48 @@ async def get_courses(
         "pages": (total + limit - 1) // limit
     }
 
+@app.get("/api/courses/suggest")
+async def suggest_courses(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    language: Optional[str] = None
+):
+    if catalog.is_fresh():
+        return {"suggestions": catalog.suggest(q, limit, language)}
+    
+    query = {"is_active": True, "title": {"$regex": f"^{re.escape(q)}", "$options": "i"}}
+    if language:
+        query["language"] = language
+    courses = db.courses.find(query, {"title": 1, "language": 1, "solution_play": 1, "course_type": 1}).limit(limit)
+    return {"suggestions": [course_suggestion(c) for c in courses]}
+
+@app.get("/api/courses/mine")
+async def get_my_courses(
+    user: dict = Depends(require_role(["training_partner"]))
+):
+    entitled, _ = user_entitlements(user)
+    if catalog.is_fresh():
+        courses = [c for c in (catalog.get(course_id) for course_id in entitled) if c and c.get("is_active")]
+    else:
+        courses = list(db.courses.find({"_id": {"$in": list(entitled)}, "is_active": True}))
+    courses.sort(key=lambda c: c.get("title") or "")
+    return {"courses": [course_response(c) for c in courses], "total": len(courses)}
+
 @app.get("/api/courses/{course_id}")
-async def get_course(course_id: str):
-    course = db.courses.find_one({"_id": course_id})
+async def get_course(course_id: str, request: Request, response: Response):
+    if catalog.is_fresh():
+        etag = catalog_etag(request.url.path)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        course = catalog.get(course_id)
+        if course:
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+    else:
+        course = db.courses.find_one({"_id": course_id})
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
-    course["id"] = course.pop("_id")
-    return course
+    return course_response(course)
 
 @app.put("/api/courses/{course_id}")
 async def update_course(
@@ -450,6 +2031,7 @@ async def update_course(
     update_data["updated_at"] = datetime.utcnow()
     
     db.courses.update_one({"_id": course_id}, {"$set": update_data})
+    catalog.refresh(course_id)
     return {"message": "Course updated successfully"}
 
 @app.delete("/api/courses/{course_id}")
@@ -463,6 +2045,10 @@ async def delete_course(
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Course not found")
+    catalog.refresh(course_id)
+    
+    # Storage cleanup happens in the background job queue
+    enqueue_job("delete_course_blobs", {"course_id": course_id}, f"delete_course_blobs:{course_id}")
     return {"message": "Course deleted successfully"}
 
 # File Upload Routes
@@ -505,6 +2091,8 @@ async def upload_course_file(
             "$set": {"updated_at": datetime.utcnow()}
         }
     )
+    catalog.refresh(course_id)
+    invalidate_course_bundles(course_id)
     
     return {"file_id": file_id, "message": "File uploaded successfully"}
 
@@ -541,6 +2129,80 @@ async def download_course_file(
     
     return {"download_url": download_url, "filename": file_info["original_name"]}
 
+@app.get("/api/courses/{course_id}/files/download-urls")
+async def get_course_download_urls(
+    course_id: str,
+    user: dict = Depends(get_current_user)
+):
+    if user["role"] == "training_partner" and not user.get("is_approved"):
+        raise HTTPException(status_code=403, detail="Your portal access is pending approval")
+    
+    course = db.courses.find_one({"_id": course_id})
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    
+    files = []
+    for file_info in course.get("files", []):
+        download_url = generate_sas_url(file_info["blob_name"])
+        if not download_url:
+            raise HTTPException(status_code=500, detail="Could not generate download URL")
+        files.append({
+            "file_id": file_info["id"],
+            "file_type": file_info.get("file_type"),
+            "filename": file_info["original_name"],
+            "size": file_info.get("size"),
+            "download_url": download_url
+        })
+    
+    if files:
+        now = datetime.utcnow()
+        db.download_logs.insert_many([
+            {
+                "_id": str(uuid.uuid4()),
+                "user_id": user["_id"],
+                "course_id": course_id,
+                "file_id": f["file_id"],
+                "downloaded_at": now
+            }
+            for f in files
+        ])
+    
+    return {"course_id": course_id, "files": files}
+
+@app.get("/api/courses/{course_id}/bundle")
+async def download_course_bundle(
+    course_id: str,
+    user: dict = Depends(get_current_user)
+):
+    if user["role"] == "training_partner" and not user.get("is_approved"):
+        raise HTTPException(status_code=403, detail="Your portal access is pending approval")
+    
+    course = db.courses.find_one({"_id": course_id})
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    
+    files = course.get("files", [])
+    if not files:
+        raise HTTPException(status_code=404, detail="No files available for this course")
+    
+    if not streaming_container_client:
+        raise HTTPException(status_code=500, detail="Azure storage not configured")
+    
+    cache_blob_name = None
+    if BUNDLE_CACHE_ENABLED:
+        cache_blob_name = bundle_blob_name(course_id, files)
+        cache_blob = container_client.get_blob_client(cache_blob_name)
+        if await asyncio.to_thread(cache_blob.exists):
+            log_bundle_download(user["_id"], course_id, files)
+            return RedirectResponse(generate_sas_url(cache_blob_name), status_code=307)
+    
+    filename = re.sub(r"[^A-Za-z0-9._-]+", "_", course.get("title", course_id)).strip("_")[:100] or course_id
+    return StreamingResponse(
+        stream_course_bundle(course_id, files, user["_id"], cache_blob_name),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.zip"'}
+    )
+
 @app.delete("/api/courses/{course_id}/files/{file_id}")
 async def delete_course_file(
     course_id: str,
@@ -555,11 +2217,6 @@ async def delete_course_file(
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Delete from Azure
-    if container_client:
-        blob_client = container_client.get_blob_client(file_info["blob_name"])
-        blob_client.delete_blob()
-    
     db.courses.update_one(
         {"_id": course_id},
         {
@@ -567,6 +2224,12 @@ async def delete_course_file(
             "$set": {"updated_at": datetime.utcnow()}
         }
     )
+    invalidate_sas_urls(file_info["blob_name"])
+    catalog.refresh(course_id)
+    
+    # Delete from Azure in the background job queue
+    enqueue_job("delete_blob", {"blob_name": file_info["blob_name"]}, f"delete_blob:{file_info['blob_name']}")
+    invalidate_course_bundles(course_id)
     
     return {"message": "File deleted successfully"}
 
@@ -579,12 +2242,8 @@ async def create_access_request(
     if user["role"] != "training_partner":
         raise HTTPException(status_code=400, detail="Only training partners can request access")
     
-    existing = db.access_requests.find_one({
-        "user_id": user["_id"],
-        "course_id": request_data.course_id,
-        "status": {"$in": ["pending", "approved"]}
-    })
-    if existing:
+    entitled, pending = user_entitlements(user)
+    if request_data.course_id in entitled or request_data.course_id in pending:
         raise HTTPException(status_code=400, detail="Access request already exists")
     
     request_id = str(uuid.uuid4())
@@ -602,6 +2261,7 @@ async def create_access_request(
     }
     
     db.access_requests.insert_one(access_request)
+    refresh_entitlements(user["_id"])
     return {"id": request_id, "message": "Access request submitted"}
 
 @app.get("/api/access-requests")
@@ -637,7 +2297,7 @@ async def update_access_request(
     if update_data.status not in ACCESS_REQUEST_STATUS:
         raise HTTPException(status_code=400, detail="Invalid status")
     
-    result = db.access_requests.update_one(
+    access_request = db.access_requests.find_one_and_update(
         {"_id": request_id},
         {
             "$set": {
@@ -647,12 +2307,15 @@ async def update_access_request(
                 "reviewed_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             }
-        }
+        },
+        projection={"user_id": 1}
     )
     
-    if result.modified_count == 0:
+    if not access_request:
         raise HTTPException(status_code=404, detail="Request not found")
     
+    refresh_entitlements(access_request["user_id"])
+    
     return {"message": f"Access request {update_data.status}"}
 
 # Execution Schedule Routes (Training Partner)
@@ -662,12 +2325,8 @@ async def create_execution_schedule(
     user: dict = Depends(require_role(["training_partner"]))
 ):
     # Check if user has access to the course
-    access = db.access_requests.find_one({
-        "user_id": user["_id"],
-        "course_id": schedule_data.course_id,
-        "status": "approved"
-    })
-    if not access:
+    entitled, _ = user_entitlements(user)
+    if schedule_data.course_id not in entitled:
         raise HTTPException(status_code=403, detail="No access to this course")
     
     execution_id = str(uuid.uuid4())
@@ -735,6 +2394,115 @@ async def submit_attendance(
     
     return {"message": "Attendance data submitted successfully"}
 
+# Partner Dashboard Route
+@app.get("/api/dashboard")
+async def get_partner_dashboard(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user: dict = Depends(require_role(["training_partner"]))
+):
+    # Everything the partner home view needs, gathered with one auth and
+    # the queries run concurrently
+    now = datetime.utcnow()
+    start, end = as_utc_naive(start), as_utc_naive(end)
+    
+    upcoming_window = {"$gte": max(start, now) if start else now}
+    # Scheduled sessions whose date has passed still need attendance submitted
+    awaiting_window = {"$lt": min(end, now) if end else now}
+    completed_window = {}
+    if start:
+        awaiting_window["$gte"] = start
+        completed_window["$gte"] = start
+    if end:
+        upcoming_window["$lt"] = end
+        completed_window["$lt"] = end
+    
+    def find_requests():
+        return list(db.access_requests.find(
+            {"user_id": user["_id"], "status": {"$in": ["pending", "approved"]}}
+        ).sort("created_at", -1))
+    
+    def find_upcoming():
+        return list(db.executions.find(
+            {"user_id": user["_id"], "status": "scheduled", "execution_date": upcoming_window}
+        ).sort("execution_date", 1))
+    
+    def find_awaiting_attendance():
+        return list(db.executions.find(
+            {"user_id": user["_id"], "status": "scheduled", "execution_date": awaiting_window}
+        ).sort("execution_date", 1))
+    
+    def find_completed():
+        query = {"user_id": user["_id"], "status": "completed"}
+        if completed_window:
+            query["execution_date"] = completed_window
+        return list(db.executions.find(query).sort("execution_date", -1))
+    
+    def count_executions():
+        return list(db.executions.aggregate([
+            {"$match": {"user_id": user["_id"]}},
+            {
+                "$group": {
+                    "_id": "$status",
+                    "count": {"$sum": 1},
+                    "learners": {"$sum": {"$ifNull": ["$actual_attendees", 0]}}
+                }
+            }
+        ]))
+    
+    requests, upcoming, awaiting, completed, execution_counts = await asyncio.gather(
+        asyncio.to_thread(find_requests),
+        asyncio.to_thread(find_upcoming),
+        asyncio.to_thread(find_awaiting_attendance),
+        asyncio.to_thread(find_completed),
+        asyncio.to_thread(count_executions)
+    )
+    
+    entitled, _ = user_entitlements(user)
+    courses = await asyncio.to_thread(
+        course_summaries,
+        [r["course_id"] for r in requests] + [e["course_id"] for e in upcoming + awaiting + completed] + list(entitled)
+    )
+    for row in requests + upcoming + awaiting + completed:
+        row["id"] = row.pop("_id")
+        row["course_title"] = courses[row["course_id"]]["title"] if row["course_id"] in courses else "Unknown"
+    
+    by_status = {row["_id"]: row for row in execution_counts}
+    return {
+        "user": {
+            "id": user["_id"],
+            "email": user["email"],
+            "full_name": user["full_name"],
+            "organization": user["organization"],
+            "domain": user.get("domain"),
+            "role": user["role"],
+            "partner_type": user.get("partner_type"),
+            "is_approved": user["is_approved"],
+            "created_at": user["created_at"]
+        },
+        "pending_requests": [r for r in requests if r["status"] == "pending"],
+        "approved_requests": [r for r in requests if r["status"] == "approved"],
+        "upcoming_executions": upcoming,
+        "awaiting_attendance_executions": awaiting,
+        "completed_executions": completed,
+        "entitled_courses": sorted(
+            (
+                {"id": course_id, "title": courses[course_id]["title"]}
+                for course_id in entitled
+                if course_id in courses and courses[course_id]["is_active"]
+            ),
+            key=lambda c: c["title"]
+        ),
+        "summary": {
+            "pending_requests": sum(1 for r in requests if r["status"] == "pending"),
+            "approved_requests": sum(1 for r in requests if r["status"] == "approved"),
+            "scheduled_executions": by_status.get("scheduled", {}).get("count", 0),
+            "awaiting_attendance": len(awaiting),
+            "completed_executions": by_status.get("completed", {}).get("count", 0),
+            "trained_learners": by_status.get("completed", {}).get("learners", 0)
+        }
+    }
+
 # User Management Routes (Admin)
 @app.get("/api/users")
 async def get_users(
@@ -745,7 +2513,7 @@ async def get_users(
     if role:
         query["role"] = role
     
-    users = list(db.users.find(query, {"password": 0}).sort("created_at", -1))
+    users = list(db.users.find(query, {"password": 0, "entitled_course_ids": 0, "pending_course_ids": 0, "entitlements_version": 0}).sort("created_at", -1))
     for u in users:
         u["id"] = u.pop("_id")
     
@@ -782,42 +2550,51 @@ async def update_user_role(
     return {"message": "User role updated"}
 
 # Analytics Routes (MS Stakeholder)
-@app.get("/api/analytics/overview")
-async def get_analytics_overview(
-    user: dict = Depends(require_role(["admin", "ms_stakeholder"]))
-):
-    total_courses = db.courses.count_documents({"is_active": True})
-    total_partners = db.users.count_documents({"role": "training_partner"})
-    total_downloads = db.download_logs.count_documents({})
-    total_executions = db.executions.count_documents({})
-    total_learners = 0
+def compute_analytics_overview() -> dict:
+    timed_out = []
+    total_courses = guarded_query("total_courses", timed_out, lambda: analytics_count("courses", {"is_active": True}))
+    total_partners = guarded_query("total_partners", timed_out, lambda: analytics_count("users", {"role": "training_partner"}))
+    
+    def count_downloads():
+        watermark = download_rollup_watermark(analytics_db)
+        total = analytics_count("download_logs", {"downloaded_at": {"$gte": watermark}} if watermark else {})
+        if watermark:
+            rolled_up = analytics_aggregate("download_daily", [{"$group": {"_id": None, "total": {"$sum": "$count"}}}])
+            if rolled_up:
+                total += rolled_up[0]["total"]
+        return total
+    
+    total_downloads = guarded_query("total_downloads", timed_out, count_downloads)
+    total_executions = guarded_query("total_executions", timed_out, lambda: analytics_count("executions", {}))
     
     # Calculate total trained learners
     pipeline = [
         {"$match": {"attendance_submitted": True}},
         {"$group": {"_id": None, "total": {"$sum": "$actual_attendees"}}}
     ]
-    result = list(db.executions.aggregate(pipeline))
-    if result:
-        total_learners = result[0]["total"]
+    result = guarded_query("total_trained_learners", timed_out, lambda: analytics_aggregate("executions", pipeline), [])
+    total_learners = result[0]["total"] if result else 0
     
-    return {
+    return with_timeouts({
         "total_courses": total_courses,
         "total_partners": total_partners,
         "total_downloads": total_downloads,
         "total_executions": total_executions,
         "total_trained_learners": total_learners
-    }
+    }, timed_out)
 
-@app.get("/api/analytics/downloads")
-async def get_download_analytics(
-    days: int = 30,
-    user: dict = Depends(require_role(["admin", "ms_stakeholder"]))
-):
-    start_date = datetime.utcnow() - timedelta(days=days)
+def compute_download_analytics(days: int) -> dict:
+    timed_out = []
+    # Whole days before the rollup watermark come from daily buckets,
+    # anything newer from the raw event stream
+    start_date = start_of_day(datetime.utcnow() - timedelta(days=days))
+    watermark = max(download_rollup_watermark(analytics_db) or start_date, start_date)
+    
+    daily_match = {"day": {"$gte": start_date, "$lt": watermark}}
+    raw_match = {"downloaded_at": {"$gte": watermark}}
     
     pipeline = [
-        {"$match": {"downloaded_at": {"$gte": start_date}}},
+        {"$match": raw_match},
         {
             "$group": {
                 "_id": {
@@ -829,30 +2606,43 @@ async def get_download_analytics(
         {"$sort": {"_id": 1}}
     ]
     
-    downloads_by_date = list(db.download_logs.aggregate(pipeline))
+    downloads_by_date = guarded_query("downloads_by_date", timed_out, lambda: analytics_aggregate("download_daily", [
+        {"$match": daily_match},
+        {"$group": {"_id": "$date", "count": {"$sum": "$count"}}},
+        {"$sort": {"_id": 1}}
+    ]) + analytics_aggregate("download_logs", pipeline), [])
     
     # Top downloaded courses
-    course_pipeline = [
-        {"$match": {"downloaded_at": {"$gte": start_date}}},
-        {"$group": {"_id": "$course_id", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]
+    def count_by_course():
+        course_counts = {}
+        for row in analytics_aggregate("download_daily", [
+            {"$match": daily_match},
+            {"$group": {"_id": "$course_id", "count": {"$sum": "$count"}}}
+        ]):
+            course_counts[row["_id"]] = row["count"]
+        for row in analytics_aggregate("download_logs", [
+            {"$match": raw_match},
+            {"$group": {"_id": "$course_id", "count": {"$sum": 1}}}
+        ]):
+            course_counts[row["_id"]] = course_counts.get(row["_id"], 0) + row["count"]
+        return course_counts
     
-    top_courses = list(db.download_logs.aggregate(course_pipeline))
+    course_counts = guarded_query("top_courses", timed_out, count_by_course, {})
+    top_courses = [
+        {"_id": course_id, "count": count}
+        for course_id, count in sorted(course_counts.items(), key=lambda item: item[1], reverse=True)[:10]
+    ]
     for tc in top_courses:
-        course = db.courses.find_one({"_id": tc["_id"]})
+        course = analytics_db.courses.find_one({"_id": tc["_id"]}, {"title": 1})
         tc["course_title"] = course["title"] if course else "Unknown"
     
-    return {
+    return with_timeouts({
         "downloads_by_date": downloads_by_date,
         "top_courses": top_courses
-    }
+    }, timed_out)
 
-@app.get("/api/analytics/learners")
-async def get_learner_analytics(
-    user: dict = Depends(require_role(["admin", "ms_stakeholder"]))
-):
+def compute_learner_analytics() -> dict:
+    timed_out = []
     # Learners by organization
     org_pipeline = [
         {"$match": {"attendance_submitted": True}},
@@ -867,7 +2657,7 @@ async def get_learner_analytics(
         {"$sort": {"total_learners": -1}}
     ]
     
-    by_organization = list(db.executions.aggregate(org_pipeline))
+    by_organization = guarded_query("by_organization", timed_out, lambda: analytics_aggregate("executions", org_pipeline), [])
     
     # Learners by course
     course_pipeline = [
@@ -883,43 +2673,122 @@ async def get_learner_analytics(
         {"$limit": 10}
     ]
     
-    by_course = list(db.executions.aggregate(course_pipeline))
+    by_course = guarded_query("by_course", timed_out, lambda: analytics_aggregate("executions", course_pipeline), [])
     for bc in by_course:
-        course = db.courses.find_one({"_id": bc["_id"]})
+        course = analytics_db.courses.find_one({"_id": bc["_id"]}, {"title": 1})
         bc["course_title"] = course["title"] if course else "Unknown"
     
-    return {
+    return with_timeouts({
         "by_organization": by_organization,
         "by_course": by_course
+    }, timed_out)
+
+# Identical concurrent requests share one computation (see SingleFlightCache)
+@app.get("/api/analytics/overview")
+async def get_analytics_overview(
+    user: dict = Depends(require_role(["admin", "ms_stakeholder"]))
+):
+    return await analytics_cache.get(("overview",), compute_analytics_overview)
+
+@app.get("/api/analytics/downloads")
+async def get_download_analytics(
+    days: int = 30,
+    user: dict = Depends(require_role(["admin", "ms_stakeholder"]))
+):
+    return await analytics_cache.get(("downloads", days), lambda: compute_download_analytics(days))
+
+@app.get("/api/analytics/learners")
+async def get_learner_analytics(
+    user: dict = Depends(require_role(["admin", "ms_stakeholder"]))
+):
+    return await analytics_cache.get(("learners",), compute_learner_analytics)
+
+# Catalog Replica Routes (Admin)
+@app.get("/api/catalog/metrics")
+async def get_catalog_metrics(
+    user: dict = Depends(require_role(["admin"]))
+):
+    return catalog.metrics()
+
+# Compression Routes (Admin)
+@app.get("/api/compression/metrics")
+async def get_compression_metrics(
+    user: dict = Depends(require_role(["admin"]))
+):
+    endpoints = {}
+    for endpoint, stats in compression_stats.items():
+        endpoints[endpoint] = {
+            **stats,
+            "ratio": round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else None,
+            "avg_compress_ms": round(stats["compress_ms"] / stats["responses"], 3) if stats["responses"] else None
+        }
+    return {
+        "encodings_available": (["br"] if brotli else []) + ["gzip"],
+        "min_size": COMPRESSION_MIN_SIZE,
+        "cache_entries": len(compressed_cache),
+        "cache_bytes": compressed_cache_state["bytes"],
+        "endpoints": endpoints
     }
 
-# Seed admin user on startup
+# Job Queue Routes (Admin)
+@app.get("/api/jobs/metrics")
+async def get_job_metrics(
+    window_minutes: int = 60,
+    user: dict = Depends(require_role(["admin"]))
+):
+    now = datetime.utcnow()
+    
+    depth_pipeline = [
+        {"$match": {"status": {"$in": ["pending", "running"]}}},
+        {"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}}
+    ]
+    queue_depth = {}
+    for row in db.jobs.aggregate(depth_pipeline):
+        queue_depth.setdefault(row["_id"]["type"], {})[row["_id"]["status"]] = row["count"]
+    
+    oldest = db.jobs.find_one({"status": "pending"}, {"run_at": 1}, sort=[("run_at", ASCENDING)])
+    
+    latency_pipeline = [
+        {"$match": {"finished_at": {"$gte": now - timedelta(minutes=window_minutes)}}},
+        {
+            "$group": {
+                "_id": {"type": "$type", "status": "$status"},
+                "count": {"$sum": 1},
+                "avg_latency_ms": {"$avg": {"$subtract": ["$finished_at", "$created_at"]}},
+                "max_latency_ms": {"$max": {"$subtract": ["$finished_at", "$created_at"]}},
+                "avg_duration_ms": {"$avg": "$duration_ms"},
+                "avg_attempts": {"$avg": "$attempts"}
+            }
+        }
+    ]
+    completed = []
+    for row in db.jobs.aggregate(latency_pipeline):
+        completed.append({"type": row["_id"]["type"], "status": row["_id"]["status"], **{k: v for k, v in row.items() if k != "_id"}})
+    
+    return {
+        "queue_depth": queue_depth,
+        "oldest_pending_age_seconds": max((now - oldest["run_at"]).total_seconds(), 0) if oldest else 0,
+        "window_minutes": window_minutes,
+        "completed": completed,
+        "workers": JOB_WORKERS
+    }
+
+# Run dependency checks and admin seeding in the background so the app
+# accepts health traffic immediately
 @app.on_event("startup")
 async def startup_event():
-    try:
-        # Test MongoDB connection
-        client.admin.command('ping')
-        print("MongoDB connection successful")
-        
-        admin = db.users.find_one({"email": "admin@skillingbox.com"})
-        if not admin:
-            admin_id = str(uuid.uuid4())
-            db.users.insert_one({
-                "_id": admin_id,
-                "email": "admin@skillingbox.com",
-                "password": hash_password("admin123"),
-                "full_name": "System Admin",
-                "organization": "Skilling Box",
-                "domain": "skillingbox.com",
-                "role": "admin",
-                "is_approved": True,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            })
-            print("Admin user created: admin@skillingbox.com / admin123")
-    except Exception as e:
-        print(f"Startup warning - MongoDB operation failed: {e}")
-        # Don't fail startup, let the app run and handle DB errors per-request
+    app.state.warm_up_task = asyncio.create_task(warm_up_dependencies())
+    for worker_id in range(JOB_WORKERS):
+        background_tasks.append(asyncio.create_task(job_worker(worker_id)))
+    background_tasks.append(asyncio.create_task(periodic_job_scheduler("sweep_orphan_blobs", ORPHAN_SWEEP_INTERVAL_MINUTES)))
+    background_tasks.append(asyncio.create_task(periodic_job_scheduler("rollup_download_logs", DOWNLOAD_ROLLUP_INTERVAL_MINUTES)))
+    print(f"Startup: accepting requests {(time.perf_counter() - PROCESS_STARTED_AT) * 1000:.1f} ms after import")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    catalog.stop()
 
 if __name__ == "__main__":
     import uvicorn